@@ -1,5 +1,6 @@
 """Anomaly Detection (Isolation Forest)."""
 # Import relevant libraries
+import joblib
 import pandas as pd
 from sklearn.ensemble import IsolationForest
 import time
@@ -129,6 +130,9 @@ def main():
         # Save the dataframes in CSV format
         exec(f'df_{i}.to_csv("isolation_forest_current_{i}.csv", index = False)')
 
+        # Persist the trained model so new readings can be scored without retraining
+        exec(f'joblib.dump(isolation_forest_1, "isolation_forest_current_{i}.joblib")')
+
     for i in range(4, 11):
         # Train the models using the data given
         exec(f'isolation_forest_2.fit(df_{i}[["Current (Ampere)"]])')
@@ -154,6 +158,9 @@ def main():
         # Save the dataframes in CSV format
         exec(f'df_{i}.to_csv("isolation_forest_current_{i}.csv", index = False)')
 
+        # Persist the trained model so new readings can be scored without retraining
+        exec(f'joblib.dump(isolation_forest_2, "isolation_forest_current_{i}.joblib")')
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,18 @@
+"""Ingestion Service (Isolation Forest) for Current (Ampere) readings.
+
+Usage: python ingestion_service_current.py <model_dir> [--port PORT] ...
+
+See ingestion_service.py in the project root for the protocol and options.
+"""
+# Import relevant libraries
+import os
+import sys
+
+# The service logic is shared by all sensors and lives in the project root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir))
+import ingestion_service  # noqa: E402
+
+
+if __name__ == '__main__':
+    ingestion_service.main(sensor="current", target_column="Current (Ampere)")
@@ -0,0 +1,414 @@
+"""Ingestion Service (Isolation Forest).
+
+Sensors push readings over TCP as newline-delimited JSON, e.g.
+
+    {"asset": "1", "Timestamp": "2021-01-01 00:05:00", "Current (Ampere)": 12}
+
+Readings are buffered per asset and scored in batches with the forest that
+the anomaly detection script persisted for that asset
+(isolation_forest_<sensor>_<asset>.joblib). Results are appended to
+live_isolation_forest_<sensor>_<asset>.csv using the same columns as the
+batch script, so the files the batch script writes are never touched.
+
+The per-sensor ingestion_service_<sensor>.py scripts are thin wrappers
+around main().
+"""
+# Import relevant libraries
+import argparse
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import math
+import os
+import re
+
+import joblib
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# The models are loaded once in every worker process by the pool initializer,
+# so batches do not have to pickle the forests on each call
+models = {}
+model_target_column = None
+
+
+def find_models(model_dir, sensor):
+    """Find the persisted Isolation Forest of every asset of a sensor.
+
+    Parameters
+    ----------
+    model_dir : string
+        Define the directory the anomaly detection script saved the models to.
+    sensor : string
+        The sensor name used in the file names, e.g. 'current'.
+
+    Returns
+    -------
+    model_paths : dict
+        The path of the joblib model file of each asset ID.
+
+    """
+    pattern = re.compile(rf"isolation_forest_{sensor}_(\w+)\.joblib", re.ASCII)
+    model_paths = {}
+    for file_name in sorted(os.listdir(model_dir)):
+        match = pattern.fullmatch(file_name)
+        if match:
+            model_paths[match.group(1)] = os.path.join(model_dir, file_name)
+    return model_paths
+
+
+def load_models(model_paths, target_column):
+    """Load the persisted Isolation Forests into the worker process.
+
+    Parameters
+    ----------
+    model_paths : dict
+        The path of the joblib model file of each asset ID.
+    target_column : string
+        The name of the column the models were trained on.
+
+    """
+    global model_target_column
+    model_target_column = target_column
+    for asset, model_path in model_paths.items():
+        model = joblib.load(model_path)
+
+        # The worker pool already provides the parallelism, so avoid every
+        # worker spawning its own set of jobs for each batch
+        model.set_params(n_jobs=1)
+        models[asset] = model
+
+
+def score_readings(asset, readings):
+    """Score a batch of readings of one asset with its persisted model.
+
+    Parameters
+    ----------
+    asset : string
+        The asset ID the readings belong to.
+    readings : list
+        The (timestamp, value) tuples to score.
+
+    Returns
+    -------
+    results : DataFrame
+        A DataFrame with the Timestamp, target, scores and anomaly columns
+        for every reading in the batch.
+
+    """
+    results = pd.DataFrame(readings, columns=["Timestamp", model_target_column])
+
+    # A single decision_function() call scores the whole batch
+    results["scores"] = models[asset].decision_function(results[[model_target_column]])
+
+    # A negative score indicates the presence of anomaly, which is the same
+    # rule predict() applies, so the anomaly column is 1 for anomalies and 0
+    # for normal data
+    results["anomaly"] = (results["scores"] < 0).astype(int)
+
+    return results
+
+
+def write_results(results, file_path):
+    """Append scored readings to a CSV file.
+
+    Parameters
+    ----------
+    results : DataFrame
+        The scored readings returned by score_readings().
+    file_path : string
+        Define the location of the CSV file.
+
+    """
+    results.to_csv(file_path, mode="a", header=not os.path.exists(file_path),
+                   index=False)
+
+
+def parse_reading(reading, assets, target_column):
+    """Validate a decoded JSON reading.
+
+    Parameters
+    ----------
+    reading : dict
+        The decoded JSON object sent by the sensor.
+    assets : collection
+        The asset IDs that have a persisted model.
+    target_column : string
+        The name of the key holding the sensor value.
+
+    Returns
+    -------
+    reading : tuple
+        The (asset, timestamp, value) of the reading.
+
+    Raises
+    ------
+    ValueError
+        If the asset has no model, the timestamp does not parse or the value
+        is not a finite number.
+    OverflowError
+        If the value is too large to convert to a float.
+
+    """
+    asset = str(reading["asset"])
+    if asset not in assets:
+        raise ValueError(f"no model for asset {asset!r}")
+
+    timestamp = reading["Timestamp"]
+    if not isinstance(timestamp, str) or pd.isna(pd.Timestamp(timestamp)):
+        raise ValueError(f"invalid Timestamp {timestamp!r}")
+
+    value = float(reading[target_column])
+    if not math.isfinite(value):
+        raise ValueError(f"non-finite {target_column} {value!r}")
+
+    return asset, str(pd.Timestamp(timestamp)), value
+
+
+class IngestionService:
+    """Buffer incoming readings per asset and score them in batches.
+
+    Parameters
+    ----------
+    executor : Executor
+        The worker pool that runs score_readings(), initialised with
+        load_models().
+    sensor : string
+        The sensor name used in the file names, e.g. 'current'.
+    target_column : string
+        The name of the key holding the sensor value.
+    assets : collection
+        The asset IDs that have a persisted model.
+    batch_size : int
+        The number of buffered readings that triggers a flush of an asset.
+    flush_interval : float
+        The number of seconds after which all buffered readings are flushed.
+    output_dir : string
+        Define the directory the CSV files are written to.
+
+    """
+
+    def __init__(self, executor, sensor, target_column, assets, batch_size,
+                 flush_interval, output_dir):
+        self.executor = executor
+        self.sensor = sensor
+        self.target_column = target_column
+        self.assets = set(assets)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.output_dir = output_dir
+        self.buffers = defaultdict(list)
+        self.flushes = set()
+        self.last_flush = {}
+        self.clients = {}
+
+    def output_path(self, asset):
+        """Return the CSV file the live results of an asset are written to."""
+        return os.path.join(self.output_dir,
+                            f"live_isolation_forest_{self.sensor}_{asset}.csv")
+
+    def add_reading(self, asset, timestamp, value):
+        """Buffer a reading and flush the asset once its batch is full."""
+        buffer = self.buffers[asset]
+        buffer.append((timestamp, value))
+        if len(buffer) >= self.batch_size:
+            self.schedule_flush([asset])
+
+    def schedule_flush(self, assets):
+        """Score the buffered readings of each asset as a separate batch."""
+        for asset in assets:
+            readings = self.buffers.pop(asset, [])
+            if not readings:
+                continue
+
+            flush = asyncio.ensure_future(
+                self.flush(asset, readings, self.last_flush.get(asset)))
+            self.flushes.add(flush)
+            flush.add_done_callback(self.flushes.discard)
+            self.last_flush[asset] = flush
+
+    async def flush(self, asset, readings, previous):
+        """Score the readings in the worker pool and write the results.
+
+        Batches are scored concurrently but the batches of an asset are
+        written in the order they were scheduled, so its rows stay in arrival
+        order. A failing batch is logged and dropped without affecting the
+        other assets.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self.executor, score_readings, asset, readings)
+            if previous is not None:
+                await asyncio.wait([previous])
+            await loop.run_in_executor(
+                None, write_results, results, self.output_path(asset))
+        except Exception:
+            logger.exception("Dropped %d readings of asset %s", len(readings), asset)
+
+    async def flush_periodically(self):
+        """Flush every asset on a fixed interval so quiet assets are scored."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.schedule_flush(list(self.buffers))
+
+    async def drain(self):
+        """Flush the remaining readings and wait for all batches to finish."""
+        self.schedule_flush(list(self.buffers))
+        if self.flushes:
+            await asyncio.gather(*self.flushes)
+
+    async def close_clients(self):
+        """Disconnect the sensors and wait for their handlers to finish.
+
+        Closing a transport stops reading from its socket, while the lines
+        already received are still parsed before the handler sees EOF.
+        """
+        # Let the handlers of connections accepted just before the server
+        # closed start, so they are disconnected as well
+        await asyncio.sleep(0)
+        for writer in self.clients.values():
+            writer.close()
+        if self.clients:
+            await asyncio.gather(*self.clients, return_exceptions=True)
+
+    async def handle_client(self, reader, writer):
+        """Read newline-delimited JSON readings from a sensor connection."""
+        handler = asyncio.current_task()
+        self.clients[handler] = writer
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError as error:
+                    # A line over the StreamReader limit breaks the framing of
+                    # the rest of the stream
+                    logger.warning("Closing connection after oversized reading: %s",
+                                   error)
+                    break
+                except ConnectionError as error:
+                    logger.warning("Connection lost: %s", error)
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    reading = json.loads(line)
+                    self.add_reading(*parse_reading(reading, self.assets,
+                                                    self.target_column))
+                except (ValueError, KeyError, TypeError, OverflowError) as error:
+                    logger.warning("Skipping reading %r: %s", line, error)
+        finally:
+            del self.clients[handler]
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+async def serve(sensor, target_column, model_dir, host, port, batch_size,
+                flush_interval, workers, output_dir):
+    """Run the ingestion service until it is cancelled.
+
+    Parameters
+    ----------
+    sensor : string
+        The sensor name used in the file names, e.g. 'current'.
+    target_column : string
+        The name of the key holding the sensor value.
+    model_dir : string
+        Define the directory the anomaly detection script saved the models to.
+    host : string
+        The interface the TCP server listens on.
+    port : int
+        The port the TCP server listens on.
+    batch_size : int
+        The number of buffered readings that triggers a flush of an asset.
+    flush_interval : float
+        The number of seconds after which all buffered readings are flushed.
+    workers : int or None
+        The number of worker processes used for scoring.
+        None means the number of processors on the machine.
+    output_dir : string
+        Define the directory the CSV files are written to.
+
+    Raises
+    ------
+    FileNotFoundError
+        If model_dir holds no persisted model for the sensor.
+
+    """
+    model_paths = find_models(model_dir, sensor)
+    if not model_paths:
+        raise FileNotFoundError(
+            f"No isolation_forest_{sensor}_<asset>.joblib models in {model_dir}")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_models,
+                             initargs=(model_paths, target_column)) as executor:
+        service = IngestionService(executor, sensor, target_column, model_paths,
+                                   batch_size, flush_interval, output_dir)
+        server = await asyncio.start_server(service.handle_client, host, port)
+        flusher = asyncio.ensure_future(service.flush_periodically())
+        logger.info("Scoring assets %s, listening on %s:%d",
+                    ", ".join(model_paths), host, port)
+        try:
+            # start_server() already serves connections, so just wait to be
+            # cancelled. serve_forever() is avoided because on cancellation it
+            # waits for every connection to close since Python 3.12, which
+            # persistent sensor connections never do
+            await asyncio.Event().wait()
+        finally:
+            # Disconnect the sensors before draining so no reading arrives
+            # after the last flush, and before waiting for the server
+            server.close()
+            flusher.cancel()
+            await service.close_clients()
+            await service.drain()
+            await server.wait_closed()
+
+
+def main(sensor, target_column):
+    """Parse the command line and run the ingestion service of a sensor.
+
+    Parameters
+    ----------
+    sensor : string
+        The sensor name used in the file names, e.g. 'current'.
+    target_column : string
+        The name of the key holding the sensor value.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("model_dir",
+                        help=f"directory of the isolation_forest_{sensor}_<asset>"
+                             ".joblib files saved by the anomaly detection script")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output-dir", default=".")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(serve(
+            sensor=sensor,
+            target_column=target_column,
+            model_dir=args.model_dir,
+            host=args.host,
+            port=args.port,
+            batch_size=args.batch_size,
+            flush_interval=args.flush_interval,
+            workers=args.workers,
+            output_dir=args.output_dir,
+        ))
+    except FileNotFoundError as error:
+        parser.error(str(error))
+    except KeyboardInterrupt:
+        pass
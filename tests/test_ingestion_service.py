@@ -0,0 +1,203 @@
+"""Tests for the asyncio ingestion service."""
+import asyncio
+import json
+import os
+import socket
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import IsolationForest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import ingestion_service  # noqa: E402
+
+TARGET_COLUMN = "Current (Ampere)"
+TIMESTAMPS = [str(t) for t in pd.date_range("2021-01-01", periods=6, freq="5min")]
+VALUES = [0, 12, 13, 12, 40, 12]
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    """Persist a differently trained forest for assets 1 and 2."""
+    rng = np.random.RandomState(0)
+    training = {"1": rng.normal(12, 1, 500), "2": rng.normal(30, 1, 500)}
+    for asset, values in training.items():
+        model = IsolationForest(contamination=0.05, random_state=42)
+        model.fit(pd.DataFrame({TARGET_COLUMN: values}))
+        joblib.dump(model, tmp_path / f"isolation_forest_current_{asset}.joblib")
+    return tmp_path
+
+
+def expected_results(model_dir, asset):
+    model = joblib.load(model_dir / f"isolation_forest_current_{asset}.joblib")
+    expected = pd.DataFrame({"Timestamp": TIMESTAMPS, TARGET_COLUMN: VALUES})
+    expected["scores"] = model.decision_function(expected[[TARGET_COLUMN]])
+    expected["anomaly"] = (model.predict(expected[[TARGET_COLUMN]]) == -1).astype(int)
+    return expected
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_service(model_dir, output_dir, batch_size, flush_interval, messages,
+                wait_for, keep_open=False):
+    """Start serve() on localhost, send the messages and stop the service.
+
+    The service is cancelled once every path in wait_for exists, or shortly
+    after sending if wait_for is empty, so the remaining readings are only
+    written by the drain on shutdown. With keep_open the client stays
+    connected while the service shuts down and must be disconnected by it.
+    """
+    port = free_port()
+
+    async def scenario():
+        service = asyncio.ensure_future(ingestion_service.serve(
+            sensor="current",
+            target_column=TARGET_COLUMN,
+            model_dir=str(model_dir),
+            host="127.0.0.1",
+            port=port,
+            batch_size=batch_size,
+            flush_interval=flush_interval,
+            workers=1,
+            output_dir=str(output_dir),
+        ))
+        for _ in range(200):
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+        writer.write("".join(f"{message}\n" for message in messages).encode())
+        await writer.drain()
+        if not keep_open:
+            writer.close()
+            await writer.wait_closed()
+
+        if not wait_for:
+            # Give the server time to read what was sent, since readings still
+            # in the socket when the sensors are disconnected are not scored
+            await asyncio.sleep(0.5)
+        for _ in range(200):
+            if all(os.path.exists(path) for path in wait_for):
+                break
+            await asyncio.sleep(0.05)
+        service.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await service
+
+        if keep_open:
+            assert await reader.read() == b""
+            writer.close()
+
+    asyncio.run(asyncio.wait_for(scenario(), timeout=30))
+
+
+def readings(asset):
+    return [json.dumps({"asset": asset, "Timestamp": t, TARGET_COLUMN: v})
+            for t, v in zip(TIMESTAMPS, VALUES)]
+
+
+def assert_written(model_dir, output_dir, asset, count=len(VALUES)):
+    written = pd.read_csv(output_dir / f"live_isolation_forest_current_{asset}.csv")
+    expected = expected_results(model_dir, asset)[:count]
+    assert list(written.columns) == list(expected.columns)
+    assert list(written["Timestamp"]) == TIMESTAMPS[:count]
+    assert np.allclose(written["scores"], expected["scores"])
+    assert list(written["anomaly"]) == list(expected["anomaly"])
+
+
+def test_batch_size_flush(model_dir, tmp_path):
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    output_path = output_dir / "live_isolation_forest_current_1.csv"
+
+    run_service(model_dir, output_dir, batch_size=len(VALUES), flush_interval=3600,
+                messages=readings("1"), wait_for=[output_path])
+
+    assert_written(model_dir, output_dir, "1")
+
+
+def test_interval_flush_scores_each_asset_with_its_own_model(model_dir, tmp_path):
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    output_paths = [output_dir / f"live_isolation_forest_current_{asset}.csv"
+                    for asset in ("1", "2")]
+
+    run_service(model_dir, output_dir, batch_size=1000, flush_interval=0.1,
+                messages=readings("1") + readings("2"), wait_for=output_paths)
+
+    assert_written(model_dir, output_dir, "1")
+    assert_written(model_dir, output_dir, "2")
+
+
+def test_drain_on_shutdown_rejects_invalid_readings(model_dir, tmp_path, caplog):
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    invalid = [
+        json.dumps({"asset": "../evil", "Timestamp": TIMESTAMPS[0], TARGET_COLUMN: 1}),
+        json.dumps({"asset": "3", "Timestamp": TIMESTAMPS[0], TARGET_COLUMN: 1}),
+        json.dumps({"asset": "1", "Timestamp": TIMESTAMPS[0], TARGET_COLUMN: float("nan")}),
+        json.dumps({"asset": "1", "Timestamp": "not a time", TARGET_COLUMN: 1}),
+        '{"asset": "1", "Timestamp": "%s", "%s": 1%s}' % (TIMESTAMPS[0], TARGET_COLUMN,
+                                                         "0" * 400),
+        "not json",
+    ]
+    # A line over the StreamReader limit closes the connection cleanly
+    oversized = [json.dumps({"asset": "1", "padding": "x" * 70000})]
+
+    run_service(model_dir, output_dir, batch_size=1000, flush_interval=3600,
+                messages=invalid + readings("1") + oversized, wait_for=[])
+
+    assert sorted(os.listdir(output_dir)) == ["live_isolation_forest_current_1.csv"]
+    assert_written(model_dir, output_dir, "1")
+    assert "Closing connection after oversized reading" in caplog.text
+    assert "Unhandled exception" not in caplog.text
+
+
+def test_shutdown_disconnects_connected_sensors_and_drains(model_dir, tmp_path):
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    # Asset 2 fills a batch, so its file shows every earlier line was read
+    # while the readings of asset 1 are still buffered
+    messages = readings("1")[:3] + readings("2")
+
+    run_service(model_dir, output_dir, batch_size=len(VALUES), flush_interval=3600,
+                messages=messages, keep_open=True,
+                wait_for=[output_dir / "live_isolation_forest_current_2.csv"])
+
+    assert_written(model_dir, output_dir, "1", count=3)
+    assert_written(model_dir, output_dir, "2")
+
+
+def test_failing_asset_does_not_drop_other_assets(model_dir, tmp_path, caplog):
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    # A directory in place of the CSV file makes writing asset 2 fail
+    (output_dir / "live_isolation_forest_current_2.csv").mkdir()
+
+    run_service(model_dir, output_dir, batch_size=1000, flush_interval=3600,
+                messages=readings("2") + readings("1"), wait_for=[])
+
+    assert_written(model_dir, output_dir, "1")
+    assert "Dropped 6 readings of asset 2" in caplog.text
+
+
+def test_negative_score_matches_predict(model_dir):
+    ingestion_service.load_models(
+        ingestion_service.find_models(str(model_dir), "current"), TARGET_COLUMN)
+    values = np.linspace(0, 40, 200)
+
+    results = ingestion_service.score_readings(
+        "1", [(TIMESTAMPS[0], value) for value in values])
+
+    model = joblib.load(model_dir / "isolation_forest_current_1.joblib")
+    predicted = model.predict(pd.DataFrame({TARGET_COLUMN: values}))
+    assert results["anomaly"].sum() > 0
+    assert list(results["anomaly"]) == list((predicted == -1).astype(int))